@@ -59,9 +59,22 @@ considered, so use the C++ implementation if speed is critical.
 #FIX:enable_points
 
 import struct
-import re
+from functools import lru_cache
 from math import *
 
+import numpy as np
+
+try:
+    from numba import njit, prange
+    _HAVE_NUMBA = True
+except ImportError: # numba is optional; kernels then run as plain Python
+    _HAVE_NUMBA = False
+    prange = range
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
 class PAError(Exception):
     """
 Exception class for exceptions raised by PA.
@@ -71,11 +84,325 @@ Exception class for exceptions raised by PA.
     def __str__(self):
         return repr(self.value)
 
-# Read nbytes length bytes from file.  Raises IOError on failure to read nbytes.
-def _read_bytes(file, nbytes):
-    s = file.read(nbytes)
-    if len(s) != nbytes: raise IOError("Bytes missing from file.")
-    return s
+# Precompiled layouts of the binary PA file header (native byte order).
+_INT_STRUCT       = struct.Struct("=i")
+_DOUBLE_STRUCT    = struct.Struct("=d")
+_HEADER_STRUCT    = struct.Struct("=idiiii")  # symmetry .. raw_mirror, after mode
+_MM_STRUCT        = struct.Struct("=ddd")     # dx_mm, dy_mm, dz_mm (mode -2)
+_FIRST_IDX_STRUCT = struct.Struct("=31i")     # PA0 electrode first indices
+
+_BOOL_STR = ("0", "1") # header text of Boolean flags
+
+_NG_MASK = (1 << 17) - 1 # ng field of raw_mirror (bits 4..20)
+
+# mirror strings: ordered subsets of "xyz"
+_VALID_MIRRORS = frozenset(['', 'x', 'y', 'z', 'xy', 'xz', 'yz', 'xyz'])
+
+# (mirror_x, mirror_y, mirror_z) of a mirror string.
+# Asserts on an invalid string, like the check_* validations.
+@lru_cache(maxsize=8)
+def _parse_mirror(mirror):
+    assert mirror in _VALID_MIRRORS, "Mirror string (" + str(mirror) + ") is invalid."
+    return ('x' in mirror, 'y' in mirror, 'z' in mirror)
+
+# Fill the writable buffer from file without intermediate copies.
+# Raises IOError on failure to read len(buf) bytes.
+def _read_into(file, buf):
+    view = memoryview(buf).cast('B')
+    if file.readinto(view) != len(view): raise IOError("Bytes missing from file.")
+    return buf
+
+# Index of the first point of each fast adjustable electrode (1..30) and of
+# the first fast scalable electrode point (0) in PA# point values, or -1.
+@njit(cache=True)
+def _compute_first_idx_loop(potentials, is_electrode):
+    first_idx = np.full(31, -1, np.int64)
+    for n in range(potentials.size):
+        fval = potentials[n]
+        if is_electrode[n] and fval >= 0.0: # electrode
+            ival = int(fval)
+            if ival == fval and ival >= 1 and ival <= 30: # fast adjustable
+                if first_idx[ival] == -1:
+                    first_idx[ival] = n
+            elif first_idx[0] == -1: # fast scalable
+                first_idx[0] = n
+    return first_idx
+
+def _compute_first_idx_numpy(potentials, is_electrode):
+    first_idx = np.full(31, -1, np.int64)
+    is_electrode = is_electrode & (potentials >= 0.0)
+    fvals = potentials
+    ivals = fvals.astype(np.int64)
+    is_fast = is_electrode & (ivals == fvals) & (ivals >= 1) & (ivals <= 30) # fast adjustable
+
+    fast_points = np.flatnonzero(is_fast)
+    fast_ivals, first = np.unique(ivals[fast_points], return_index=True)
+    first_idx[fast_ivals] = fast_points[first]
+
+    scalable_points = np.flatnonzero(is_electrode & ~is_fast) # fast scalable
+    if scalable_points.size: first_idx[0] = scalable_points[0]
+    return first_idx
+
+_compute_first_idx = _HAVE_NUMBA and _compute_first_idx_loop or _compute_first_idx_numpy
+
+# Interpolated potential at a non-negative real point of a 2D array
+# (planar with nz == 1, or cylindrical with y being the radius).
+@njit(cache=True)
+def _bilinear_2d(potentials, nx, xeff, yeff):
+    xi = int(xeff)
+    yi = int(yeff)
+    wx = xeff - xi
+    wy = yeff - yi
+    # Offsets to the upper corners are clamped to 0 when the weight is 0,
+    # which protects against cases where xi + 1 == nx or yi + 1 == ny
+    # without branching: the clamped corner is then multiplied by 0.
+    pos = yi * nx + xi
+    dx = int(wx > 0)
+    dy = int(wy > 0) * nx
+    return (1-wx) * (1-wy) * potentials[pos] + \
+              wx  * (1-wy) * potentials[pos + dx] + \
+           (1-wx) *    wy  * potentials[pos + dy] + \
+              wx  *    wy  * potentials[pos + dy + dx]
+
+# Interpolated potential at a non-negative real point of a 3D planar array.
+@njit(cache=True)
+def _trilinear_3d(potentials, nx, ny, xeff, yeff, zeff):
+    xi = int(xeff)
+    yi = int(yeff)
+    zi = int(zeff)
+    wx = xeff - xi
+    wy = yeff - yi
+    wz = zeff - zi
+    # See _bilinear_2d for the clamping of the upper corner offsets.
+    pos = (zi * ny + yi) * nx + xi
+    dx = int(wx > 0)
+    dy = int(wy > 0) * nx
+    dz = int(wz > 0) * nx * ny
+    return (1-wx)*(1-wy)*(1-wz)*potentials[pos] + \
+              wx *(1-wy)*(1-wz)*potentials[pos + dx] + \
+           (1-wx)*   wy *(1-wz)*potentials[pos + dy] + \
+              wx *   wy *(1-wz)*potentials[pos + dy + dx] + \
+           (1-wx)*(1-wy)*   wz *potentials[pos + dz] + \
+              wx *(1-wy)*   wz *potentials[pos + dz + dx] + \
+           (1-wx)*   wy *   wz *potentials[pos + dz + dy] + \
+              wx *   wy *   wz *potentials[pos + dz + dy + dx]
+
+# Field (unscaled by ng) at the real point (x, y, z) of a planar array via
+# central differences (see PA.field_real); min_x, min_y and min_z are the
+# lower sampling bounds.
+@njit(cache=True)
+def _field_planar(potentials, nx, ny, nz, min_x, min_y, min_z, x, y, z):
+    #FIX:Q:is there a better way to handle boundary conditions?
+    xm = max(x - 0.5, min_x)
+    xp = min(x + 0.5, nx - 1)
+    ym = max(y - 0.5, min_y)
+    yp = min(y + 0.5, ny - 1)
+    xeff = abs(x)
+    yeff = abs(y)
+    if nz == 1: # 2D
+        V2 = _bilinear_2d(potentials, nx, abs(xp), yeff)
+        V1 = _bilinear_2d(potentials, nx, abs(xm), yeff)
+        V4 = _bilinear_2d(potentials, nx, xeff, abs(yp))
+        V3 = _bilinear_2d(potentials, nx, xeff, abs(ym))
+        Ez = 0.0
+    else: # 3D
+        zeff = abs(z)
+        zm = max(z - 0.5, min_z)
+        zp = min(z + 0.5, nz - 1)
+        V2 = _trilinear_3d(potentials, nx, ny, abs(xp), yeff, zeff)
+        V1 = _trilinear_3d(potentials, nx, ny, abs(xm), yeff, zeff)
+        V4 = _trilinear_3d(potentials, nx, ny, xeff, abs(yp), zeff)
+        V3 = _trilinear_3d(potentials, nx, ny, xeff, abs(ym), zeff)
+        V6 = _trilinear_3d(potentials, nx, ny, xeff, yeff, abs(zp))
+        V5 = _trilinear_3d(potentials, nx, ny, xeff, yeff, abs(zm))
+        Ez = (V5 - V6) / (zp - zm)
+    Ex = (V1 - V2) / (xp - xm)
+    Ey = (V3 - V4) / (yp - ym)
+    return (Ex, Ey, Ez)
+
+# Field (unscaled by ng) at the real point (x, y, z) of a cylindrical array
+# (see PA.field_real); min_x is the lower x sampling bound.
+@njit(cache=True)
+def _field_cylindrical(potentials, nx, ny, min_x, x, y, z):
+    r = sqrt(y*y + z*z)
+    xeff = abs(x)
+    xm = max(x - 0.5, min_x)
+    xp = min(x + 0.5, nx - 1)
+    rm = max(r - 0.5, -(ny - 1)) # won't occur?
+    rp = min(r + 0.5, ny - 1)
+    # FIX:Q:should the sampling be done before or after
+    # applying cylindrical symmetry?
+    V2 = _bilinear_2d(potentials, nx, abs(xp), r)
+    V1 = _bilinear_2d(potentials, nx, abs(xm), r)
+    V4 = _bilinear_2d(potentials, nx, xeff, abs(rp))
+    V3 = _bilinear_2d(potentials, nx, xeff, abs(rm))
+    Ex = (V1 - V2) / (xp - xm)
+    Er = (V3 - V4) / (rp - rm)
+    if r == 0:
+        return (Ex, Er, 0.0)
+    return (Ex, Er * (y / r), Er * (z / r))
+
+# Potential at each of the real points (xs[i], ys[i], zs[i]) of a planar array.
+@njit(parallel=True, cache=True)
+def _potential_real_planar_batch(potentials, nx, ny, nz, xs, ys, zs, ps):
+    for i in prange(xs.size):
+        if nz == 1: # 2D
+            ps[i] = _bilinear_2d(potentials, nx, abs(xs[i]), abs(ys[i]))
+        else: # 3D
+            ps[i] = _trilinear_3d(potentials, nx, ny, abs(xs[i]), abs(ys[i]), abs(zs[i]))
+
+# Potential at each of the real points (xs[i], ys[i], zs[i]) of a cylindrical array.
+@njit(parallel=True, cache=True)
+def _potential_real_cylindrical_batch(potentials, nx, xs, ys, zs, ps):
+    for i in prange(xs.size):
+        r = sqrt(ys[i]*ys[i] + zs[i]*zs[i])
+        ps[i] = _bilinear_2d(potentials, nx, abs(xs[i]), r)
+
+# Field at each of the real points (xs[i], ys[i], zs[i]) of a planar array.
+@njit(parallel=True, cache=True)
+def _field_real_planar_batch(potentials, nx, ny, nz, min_x, min_y, min_z,
+                             scale, xs, ys, zs, exs, eys, ezs):
+    for i in prange(xs.size):
+        Ex, Ey, Ez = _field_planar(potentials, nx, ny, nz, min_x, min_y, min_z,
+                                   xs[i], ys[i], zs[i])
+        exs[i] = Ex * scale
+        eys[i] = Ey * scale
+        ezs[i] = Ez * scale
+
+# Field at each of the real points (xs[i], ys[i], zs[i]) of a cylindrical array.
+@njit(parallel=True, cache=True)
+def _field_real_cylindrical_batch(potentials, nx, ny, min_x,
+                                  scale, xs, ys, zs, exs, eys, ezs):
+    for i in prange(xs.size):
+        Ex, Ey, Ez = _field_cylindrical(potentials, nx, ny, min_x, xs[i], ys[i], zs[i])
+        exs[i] = Ex * scale
+        eys[i] = Ey * scale
+        ezs[i] = Ez * scale
+# Edge (in y and z) of the tiles of the full-grid field traversal: each
+# tile streams whole x rows while its z-1..z+1 stencil planes stay cached.
+_FIELD_TILE = 8
+
+# Field at all grid points into (nz, ny, nx) arrays (see PA.field_real_grid).
+@njit(parallel=True, cache=True)
+def _field_real_grid(potentials, nx, ny, nz, min_x, min_y, min_z, cylindrical, scale,
+                     exs, eys, ezs):
+    ntiles_y = (ny + _FIELD_TILE - 1) // _FIELD_TILE
+    ntiles_z = (nz + _FIELD_TILE - 1) // _FIELD_TILE
+    for tile in prange(ntiles_y * ntiles_z):
+        zb = (tile // ntiles_y) * _FIELD_TILE
+        yb = (tile % ntiles_y) * _FIELD_TILE
+        for z in range(zb, min(zb + _FIELD_TILE, nz)):
+            for y in range(yb, min(yb + _FIELD_TILE, ny)):
+                for x in range(nx):
+                    if cylindrical:
+                        Ex, Ey, Ez = _field_cylindrical(potentials, nx, ny, min_x,
+                                                        float(x), float(y), 0.0)
+                    else:
+                        Ex, Ey, Ez = _field_planar(potentials, nx, ny, nz, min_x, min_y, min_z,
+                                                   float(x), float(y), float(z))
+                    exs[z, y, x] = Ex * scale
+                    eys[z, y, x] = Ey * scale
+                    ezs[z, y, x] = Ez * scale
+
+# Raw value (see PA.raw) of point (x, y, z).
+@njit(cache=True)
+def _raw_at(potentials, is_electrode, x, y, z, max_voltage):
+    val = potentials[z, y, x]
+    if is_electrode[z, y, x]: val += 2.0 * max_voltage
+    return val
+
+# Sets point (x, y, z) to a non-electrode with potential val, like
+# PA.point(x, y, z, 0, val).  Returns the max_voltage raised as PA.point does.
+@njit(cache=True)
+def _set_potential(potentials, is_electrode, x, y, z, val, max_voltage):
+    if val > max_voltage: max_voltage = val * 2.0
+    potentials[z, y, x] = val
+    is_electrode[z, y, x] = False
+    return max_voltage
+
+# Sets the field (field_x, field_y, field_z) at point (x, y, z), where
+# the field is already divided by ng for magnetic arrays.
+# Returns the (possibly raised) max_voltage to store back into PA.
+#
+# Performs numerical integration to solve the following for V:
+#
+#   E = - grad(V)
+#
+# This is done by the line integral:
+#
+#   V(x,y,z) = V(0,0,0) + line_integral_{C} E * n ds
+#
+# where C is an arbitrary path from (0,0,0) to (x,y,z).  For
+# each point (x,y,z), we actually do a weighted average of all
+# lattice paths (0,0,0) to (x,y,z) of length x+y+z.  In this
+# algorithm, the trapezoidal rule is used for the numerical
+# integration due to a nice algorithm requiring only O(1)
+# additional memory usage.
+#
+# Currently, V(0,0,0) is assumed to be zero.
+@njit(cache=True)
+def _set_field_at(potentials, is_electrode, x, y, z, field_x, field_y, field_z, max_voltage):
+    nz, ny, nx = potentials.shape
+
+    if x != nx - 1:
+        max_voltage = _set_potential(potentials, is_electrode, x + 1, y, z,
+            _raw_at(potentials, is_electrode, x + 1, y, z, max_voltage) - field_x,
+            max_voltage)
+    if y != ny - 1:
+        max_voltage = _set_potential(potentials, is_electrode, x, y + 1, z,
+            _raw_at(potentials, is_electrode, x, y + 1, z, max_voltage) - field_y,
+            max_voltage)
+    if z != nz - 1:
+        max_voltage = _set_potential(potentials, is_electrode, x, y, z + 1,
+            _raw_at(potentials, is_electrode, x, y, z + 1, max_voltage) - field_z,
+            max_voltage)
+
+    raw = _raw_at(potentials, is_electrode, x, y, z, max_voltage)
+    if x != 0 and y != 0 and z != 0:
+        val = \
+            (potentials[z,   y,   x-1] + \
+             potentials[z,   y-1, x  ] + \
+             potentials[z-1, y,   x  ]) / 3.0 + \
+            (raw - field_x - field_y - field_z) / 6.0
+    elif x != 0 and y != 0: # z == 0
+        val = \
+            (potentials[z,   y,   x-1] + \
+             potentials[z,   y-1, x  ]) / 2.0 + \
+            (raw - field_x - field_y) / 4.0
+    elif x != 0 and z != 0: # y == 0
+        val = \
+            (potentials[z,   y,   x-1] + \
+             potentials[z-1, y,   x  ]) / 2.0 + \
+            (raw - field_x - field_z) / 4.0
+    elif y != 0 and z != 0: # x == 0
+        val = \
+            (potentials[z,   y-1, x  ] + \
+             potentials[z-1, y,   x  ]) / 2.0 + \
+            (raw - field_y - field_z) / 4.0
+    elif z != 0: # x == 0 and y == 0
+        val = potentials[z-1, y, x] + (raw - field_z) / 2.0
+    elif y != 0: # x == 0 and z == 0
+        val = potentials[z, y-1, x] + (raw - field_y) / 2.0
+    elif x != 0: # y == 0 and z == 0
+        val = potentials[z, y, x-1] + (raw - field_x) / 2.0
+    else: # x == 0 and y == 0 and z == 0
+        val = 0.0
+
+    return _set_potential(potentials, is_electrode, x, y, z, val, max_voltage)
+
+# _set_field_at for all points in the lexographic order required by
+# PA.field, with the fields given as (nz, ny, nx) arrays.
+# Returns the (possibly raised) max_voltage to store back into PA.
+@njit(cache=True)
+def _set_field_grid(potentials, is_electrode, field_xs, field_ys, field_zs, max_voltage):
+    nz, ny, nx = potentials.shape
+    for z in range(nz):
+        for y in range(ny):
+            for x in range(nx):
+                max_voltage = _set_field_at(potentials, is_electrode, x, y, z,
+                    field_xs[z, y, x], field_ys[z, y, x], field_zs[z, y, x],
+                    max_voltage)
+    return max_voltage
 
 
 class PA:
@@ -87,6 +414,19 @@ This is a Python class for reading/writing/modifying SIMION potential arrays.
 =cut
     """
 
+    __slots__ = (
+        '_mode', '_symmetry', '_max_voltage', '_two_max_voltage',
+        '_nx', '_ny', '_nz', '_ny_minus_1_sq',
+        '_mirror_x', '_mirror_y', '_mirror_z',
+        '_min_x', '_min_y', '_min_z',
+        '_field_type', '_ng', '_field_scale',
+        '_dx_mm', '_dy_mm', '_dz_mm',
+        '_enable_points', '_fast_adjustable',
+        '_file', '_error', '_pasharp',
+        '_potentials', '_potentials_flat', '_is_electrode',
+        '_header_cache'
+    )
+
     # Group: Construction and Serialization    
 
     #FIX params
@@ -157,15 +497,20 @@ omitted:
         self._mode            = None
         self._symmetry        = None
         self._max_voltage     = None
+        self._two_max_voltage = None # raw value offset of electrodes
         self._nx              = None
         self._ny              = None
         self._nz              = None
-        self._mirror          = None
+        self._ny_minus_1_sq   = None # (ny-1)**2, radius bound squared
         self._mirror_x        = None
         self._mirror_y        = None
         self._mirror_z        = None
+        self._min_x           = None # lowest real x, y and z inside the array
+        self._min_y           = None
+        self._min_z           = None
         self._field_type      = None
         self._ng              = None
+        self._field_scale     = None # field multiplier: ng if magnetic, else 1
         self._dx_mm           = None
         self._dy_mm           = None
         self._dz_mm           = None
@@ -174,6 +519,7 @@ omitted:
         self._file            = None
         self._error           = None
         self._pasharp         = None
+        self._header_cache    = None # binary header bytes, rebuilt lazily by save()
 
         if file == None: # defaults
             if mode == None:            mode = -1
@@ -261,29 +607,36 @@ Returns: string containing header information as text.
 
 =cut
         """
-        text = \
-"begin_header\n"       + \
-"    mode "            + str(self.mode()) + "\n" + \
-"    symmetry "        + self.symmetry() + "\n" + \
-"    max_voltage "     + str(self.max_voltage()) + "\n" + \
-"    nx "              + str(self.nx()) + "\n" + \
-"    ny "              + str(self.ny()) + "\n" + \
-"    nz "              + str(self.nz()) + "\n" + \
-"    mirror_x "        + (self.mirror_x() and "1" or "0") + "\n" + \
-"    mirror_y "        + (self.mirror_y() and "1" or "0") + "\n" + \
-"    mirror_z "        + (self.mirror_z() and "1" or "0") + "\n" + \
-"    field_type "      + self.field_type() + "\n" + \
-"    ng "              + str(self.ng()) + "\n"
-
-        if self.mode() <= -2:
-            text += \
-"    dx_mm "     + str(self.dx_mm()) + "\n" + \
-"    dy_mm "     + str(self.dy_mm()) + "\n" + \
-"    dz_mm "     + str(self.dz_mm()) + "\n"
-
-        text += \
-"    fast_adjustable " + (self.fast_adjustable() and "1" or "0") + "\n" + \
-"end_header\n"
+        mode = self.mode()
+        text = (
+"begin_header\n"
+"    mode %s\n"
+"    symmetry %s\n"
+"    max_voltage %s\n"
+"    nx %s\n"
+"    ny %s\n"
+"    nz %s\n"
+"    mirror_x %s\n"
+"    mirror_y %s\n"
+"    mirror_z %s\n"
+"    field_type %s\n"
+"    ng %s\n") % (
+            mode, self._symmetry, self._max_voltage,
+            self._nx, self._ny, self._nz,
+            _BOOL_STR[bool(self._mirror_x)],
+            _BOOL_STR[bool(self._mirror_y)],
+            _BOOL_STR[bool(self._mirror_z)],
+            self._field_type, self._ng)
+
+        if mode <= -2:
+            text += (
+"    dx_mm %s\n"
+"    dy_mm %s\n"
+"    dz_mm %s\n") % (self._dx_mm, self._dy_mm, self._dz_mm)
+
+        text += (
+"    fast_adjustable %s\n"
+"end_header\n") % _BOOL_STR[bool(self._fast_adjustable)]
         return text
 
         
@@ -311,48 +664,51 @@ On error, raises PAError.
 =cut
         """
         try:
-            f = None
-            f = open(path, 'rb')
-            (mode,) = struct.unpack("i", _read_bytes(f, 4))
-            if mode != -1 and mode != -2:
-                raise PAError("invalid mode (%(mode)d)" % {'mode': mode})
-            (symmetry, max_voltage, nx, ny, nz, raw_mirror) \
-                = struct.unpack("=idiiii", _read_bytes(f, 4 + 8 + 4*4))
-            if mode <= -2:
-                (dx_mm, dy_mm, dz_mm) \
-                = struct.unpack("ddd", _read_bytes(f, 8*3))
-            else:
-                (dx_mm, dy_mm, dz_mm) = (1,1,1)
-
-            self._mode = mode
-            self._symmetry = symmetry and "planar" or "cylindrical"
-            self._max_voltage = max_voltage
-            self._nx = nx
-            self._ny = ny
-            self._nz = nz
-            self._mirror_x = raw_mirror & 1
-            self._mirror_y = (raw_mirror >> 1) & 1
-            self._mirror_z = (raw_mirror >> 2) & 1
-            self._field_type = ((raw_mirror >> 3) & 1) and "magnetic" or "electrostatic"
-            self._ng = (raw_mirror >> 4) & ((1 << 17)-1)
-            self._dx_mm = dx_mm
-            self._dy_mm = dy_mm
-            self._dz_mm = dz_mm
-            self._fast_adjustable = re.search('#$', path) != None
-            # self._enable_points = 
-
-            fx = "d" * self._nx
-            num_points = self._nx * self._ny * self._nz
-            self._points = [0] * num_points # allocate
-            for n in range(0, num_points, self._nx):
-                buf = f.read(self._nx * 8)
-                self._points[n:n+self._nx] = list(struct.unpack(fx, buf))
-            f.close()                
-        except PAError as e:
-            if f: f.close()
-            raise PAError("Failed reading file \"" + path + "\": " + str(e))
-        except IOError as e:
-            if f: f.close()
+            with open(path, 'rb') as f:
+                header = _read_into(f, bytearray(_INT_STRUCT.size + _HEADER_STRUCT.size))
+                (mode,) = _INT_STRUCT.unpack_from(header, 0)
+                if mode != -1 and mode != -2:
+                    raise PAError("invalid mode (%(mode)d)" % {'mode': mode})
+                (symmetry, max_voltage, nx, ny, nz, raw_mirror) \
+                    = _HEADER_STRUCT.unpack_from(header, _INT_STRUCT.size)
+                if mode <= -2:
+                    (dx_mm, dy_mm, dz_mm) \
+                    = _MM_STRUCT.unpack_from(_read_into(f, bytearray(_MM_STRUCT.size)))
+                else:
+                    (dx_mm, dy_mm, dz_mm) = (1,1,1)
+
+                # read and decode raw values (see raw) in place before touching
+                # any state, so that a failed load leaves the array unchanged
+                two_max_voltage = 2.0 * max_voltage
+                potentials = _read_into(f, np.empty((nz, ny, nx), dtype=np.float64))
+                is_electrode = potentials > max_voltage
+                np.subtract(potentials, two_max_voltage, out=potentials,
+                            where=is_electrode)
+
+                self._mode = mode
+                self._symmetry = symmetry and "planar" or "cylindrical"
+                self._max_voltage = max_voltage
+                self._two_max_voltage = two_max_voltage
+                self._nx = nx
+                self._ny = ny
+                self._nz = nz
+                self._ny_minus_1_sq = (ny-1) * (ny-1)
+                (self._mirror_x, self._mirror_y, self._mirror_z, is_magnetic, self._ng) = (
+                    raw_mirror & 1, (raw_mirror >> 1) & 1, (raw_mirror >> 2) & 1,
+                    (raw_mirror >> 3) & 1, (raw_mirror >> 4) & _NG_MASK)
+                self._update_min_bounds()
+                self._field_type = is_magnetic and "magnetic" or "electrostatic"
+                self._update_field_scale()
+                self._dx_mm = dx_mm
+                self._dy_mm = dy_mm
+                self._dz_mm = dz_mm
+                self._fast_adjustable = path.endswith('#')
+                self._header_cache = None
+                # self._enable_points = 
+                self._is_electrode = is_electrode
+                self._potentials = potentials
+                self._potentials_flat = potentials.reshape(-1) # view, shares memory
+        except (PAError, IOError) as e:
             raise PAError("Failed reading file \"" + path + "\": " + str(e))
  
 
@@ -384,69 +740,35 @@ On failure, raises PAError.
         self._mirror_z &= 0x1;
 
         try:
-            f = open(path, 'wb')
+            with open(path, 'wb') as f:
+                if self._header_cache is None:
+                    self._header_cache = self._build_header_bytes()
+                f.write(self._header_cache)
                                             
-            symmetry = (self._symmetry == "planar") and 1 or 0
-
-            raw_mirror = 0
-            if self._mirror_x: raw_mirror |= 1
-            if self._mirror_y: raw_mirror |= 2
-            if self._mirror_z: raw_mirror |= 4
-            if self._field_type == "magnetic": raw_mirror |= 8
-            if self._ng >= 1 and self._ng <= 90000 and self._ng == floor(self._ng):
-                raw_mirror |= (self._ng << 4)
-            header_str = struct.pack("iidiiii", self.mode(), symmetry, self._max_voltage, \
-                self._nx, self._ny, self._nz, raw_mirror)
-            if self.mode() <= -2:
-                header_str += struct.pack("ddd", \
-                    self._dx_mm, self._dy_mm, self._dz_mm)
-
-            f.write(header_str)
-                                            
-            fx = "d" * self._nx
-            num_points = len(self._points)
-            for n in range(0, num_points, self._nx):
-                buf = struct.pack(fx, *self._points[n:n+self._nx])
-                f.write(buf)
-
-            # record stats in PA0 file.
-            if self._pasharp != None:
-                assert self._pasharp.nx() == self.nx() and self._pasharp.ny() == self.ny() \
-                          and self._pasharp.nz() == self.nz(), \
-                          "PA# dimensions does not match PA0 dimensions"
-
-                first_idx = [-1] * 31
-
-                for n in range(0, num_points):
-                    fval = self._pasharp._points[n]
-                    if fval >= 2 * self._pasharp.max_voltage():  # electrode
-                        fval -= 2 * self._pasharp.max_voltage()
-    
-                        ival = int(fval)
-                        if ival == fval and ival >= 1 and ival <= 30: # fast adjustable
-                            if first_idx[ival] == -1:
-                                # print ival, " ", n, "\n"
-                                first_idx[ival] = n;
-                        elif first_idx[0] == -1: # fast scalable
-                            first_idx[0] = n
+                raw = self._potentials.copy()
+                np.add(raw, self._two_max_voltage, out=raw, where=self._is_electrode)
+                raw.tofile(f)
 
-    
-                num_electrodes = (first_idx[0] != -1) and 1 or 0;
-                for n in range(1, 31):
-                    if first_idx[n] != -1:
-                        num_electrodes = num_electrodes+1
+                # record stats in PA0 file.
+                if self._pasharp != None:
+                    assert self._pasharp.size() == self.size(), \
+                              "PA# dimensions does not match PA0 dimensions"
 
-                f.write(struct.pack("i", num_electrodes))
-                f.write(struct.pack("d", 10000.0))
+                    first_idx = _compute_first_idx(
+                        self._pasharp._potentials_flat,
+                        self._pasharp._is_electrode.reshape(-1)).tolist()
 
-                for n in range(0, 31):
-                    f.write(struct.pack("i", first_idx[n]))
+                    num_electrodes = (first_idx[0] != -1) and 1 or 0;
+                    for n in range(1, 31):
+                        if first_idx[n] != -1:
+                            num_electrodes = num_electrodes+1
 
-                f.write(struct.pack("i", -1))
+                    f.write(_INT_STRUCT.pack(num_electrodes))
+                    f.write(_DOUBLE_STRUCT.pack(10000.0))
+                    f.write(_FIRST_IDX_STRUCT.pack(*first_idx))
+                    f.write(_INT_STRUCT.pack(-1))
 
-            f.close()
         except IOError as e:
-            if f: f.close()
             raise PAError("Failed writing file \"" + path + "\": " + str(e))
 
     # Group: Getters and Setters
@@ -505,6 +827,8 @@ Returns: field_type (if getting)
         if field_type == None: return self._field_type
         assert self.check_field_type(field_type), self.error()
         self._field_type = field_type
+        self._update_field_scale()
+        self._header_cache = None
 
     def mode(self, mode=None):
         """
@@ -539,6 +863,7 @@ Returns: mode (if getting).
             return self._mode
         assert self.check_mode(mode), self.error()
         self._mode = mode
+        self._header_cache = None
                                             
     def max_voltage(self, max_voltage=None):
         """
@@ -569,15 +894,10 @@ the maximum potential in the array.
         if max_voltage == None: return self._max_voltage
         assert self.check_max_voltage(max_voltage), self.error()
 
-        num_points = self._nx * self._ny * self._nz
-
-        old_max_voltage = self._max_voltage
-        diff = -2 * self._max_voltage + 2 * max_voltage
-
+        # potentials are stored decoded, so only raw values change.
         self._max_voltage = max_voltage
-        for n in range(num_points):
-            if self._points[n] > old_max_voltage:
-                self._points[n] += diff
+        self._two_max_voltage = 2.0 * max_voltage
+        self._header_cache = None
 
     def mirror(self, mirror=None):
         """
@@ -612,12 +932,12 @@ Returns: mirror (if getting)
             if self._mirror_z: str += 'z'
             return str
         else:
-            # assert self.check_mirror(mirror), self.error()
-            m = re.match('^(x?)(y?)(z?)$', mirror)
-            assert m != None, 'Mirror string (' + mirror + ') is invalid.'
-            self._mirror_x = m.group(1) != ''
-            self._mirror_y = m.group(2) != ''
-            self._mirror_z = m.group(3) != ''
+            (mirror_x, mirror_y, mirror_z) = _parse_mirror(mirror)
+            self._mirror_x = mirror_x
+            self._mirror_y = mirror_y
+            self._mirror_z = mirror_z
+            self._update_min_bounds()
+            self._header_cache = None
 
     def mirror_x(self, mirror_x=None):
         """
@@ -636,6 +956,8 @@ direction.
         """
         if mirror_x == None: return self._mirror_x
         self._mirror_x = not not mirror_x
+        self._update_min_bounds()
+        self._header_cache = None
 
     def mirror_y(self, mirror_y=None):
         """
@@ -661,6 +983,8 @@ direction.
             mirror_z = self._mirror_z
         ), self.error()
         self._mirror_y = not not mirror_y
+        self._update_min_bounds()
+        self._header_cache = None
 
     def mirror_z(self, mirror_z=None):
         """
@@ -686,6 +1010,8 @@ direction.
             mirror_z = mirror_z
         ), self.error()
         self._mirror_z = not not mirror_z
+        self._update_min_bounds()
+        self._header_cache = None
 
     def ng(self, ng=None):
         """
@@ -712,6 +1038,8 @@ Returns: ng (if getting)
         if ng == None: return self._ng
         assert self.check_ng(ng), self.error()
         self._ng = ng
+        self._update_field_scale()
+        self._header_cache = None
 
     def num_points(self):
         """
@@ -730,7 +1058,7 @@ Returns: integer containing number of grid points.
 
 =cut
         """
-        return self._nx * self._ny * self._nz
+        return self._potentials.size
 
     def num_voxels(self):
         """
@@ -943,7 +1271,7 @@ See the individual setter methods for details on each parameter.
                 assert mirror_y == None, "mirror and mirror_y named parameters cannot coexist."
                 assert mirror_z == None, "mirror and mirror_z named parameters cannot coexist."
 
-                (mirror_x, mirror_y, mirror_z) = self._parse_mirror(mirror)
+                (mirror_x, mirror_y, mirror_z) = _parse_mirror(mirror)
 
             # defaults
             if symmetry == 'cylindrical' and mirror_y == None:
@@ -968,16 +1296,9 @@ See the individual setter methods for details on each parameter.
             assert dz_mm == None or       self.check_dz_mm(dz_mm), \
                                           self.error()
 
-            if mirror_x != None or mirror_y != None or mirror_z != None:
-                if mirror_x == None: mirror_x = self._mirror_x
-                if mirror_y == None: mirror_y = self._mirror_y
-                if mirror_z == None: mirror_z = self._mirror_z
-                mirror_str = ''
-                if mirror_x: mirror_str += 'x'
-                if mirror_y: mirror_str += 'y'
-                if mirror_z: mirror_str += 'z'
-
-                assert self.check_mirror(mirror_str), self.error()
+            # Any combination of mirror_x/y/z flags is a valid mirroring, so
+            # there is no need to build and check a mirror string here;
+            # the interdependent checks are done by check() below.
 
             if nx != None or ny != None or nz != None:
                 if nx == None: nx = self._nx
@@ -1003,9 +1324,12 @@ See the individual setter methods for details on each parameter.
 
             # set
             if mode != None: self._mode = mode
-            if max_voltage != None: self._max_voltage = max_voltage
+            if max_voltage != None:
+                self._max_voltage = max_voltage
+                self._two_max_voltage = 2.0 * max_voltage
             if field_type != None: self._field_type = field_type
             if ng != None: self._ng = ng
+            if field_type != None or ng != None: self._update_field_scale()
             if fast_adjustable != None: self._fast_adjustable = not not fast_adjustable
             if enable_points != None: self._enable_points = not not enable_points
             if symmetry != None: self._symmetry = symmetry
@@ -1015,9 +1339,11 @@ See the individual setter methods for details on each parameter.
             if dx_mm != None: self._dx_mm = dx_mm
             if dy_mm != None: self._dy_mm = dy_mm
             if dz_mm != None: self._dz_mm = dz_mm
+            self._header_cache = None
     #FIX:not throws?
             if nx != None and (nx != self._nx or ny != self._ny or nz != self._nz):
                 self.size(nx, ny, nz)
+            self._update_min_bounds()
 
 
     def size(self, nx=None, ny=None, nz=None):
@@ -1061,8 +1387,16 @@ Returns: (nx, ny, nz) tuple (if getting)
         self._nx = nx;
         self._ny = ny;
         self._nz = nz;
+        self._ny_minus_1_sq = (ny-1) * (ny-1)
+        self._update_min_bounds()
+        self._header_cache = None
 
-        self._points = [0] * (nx * ny * nz)
+        # points are stored as C-contiguous (nz, ny, nx) arrays, i.e. in the
+        # same order as in the file: potentials and electrode flags apart
+        # (decoded from raw values); _potentials_flat is a 1D view.
+        self._potentials = np.zeros((nz, ny, nx), dtype=np.float64)
+        self._potentials_flat = self._potentials.reshape(-1)
+        self._is_electrode = np.zeros((nz, ny, nx), dtype=np.bool_)
 
     def symmetry(self, symmetry=None):
         """
@@ -1096,6 +1430,7 @@ Returns: symmetry (if getting).
             mirror_z = self._mirror_z
         ), self.error()
         self._symmetry = symmetry
+        self._header_cache = None
 
     def dx_mm(self, value=None):
         """
@@ -1120,6 +1455,7 @@ Gets or sets the grid unit size (mm) in the x direction.  Requires SIMION 8.1.
         if value == None: return self._dx_mm
         assert self.check_dx_mm(value), self.error()
         self._dx_mm = value
+        self._header_cache = None
 
     def dy_mm(self, value=None):
         """
@@ -1144,6 +1480,7 @@ Gets or sets the grid unit size (mm) in the y direction.  Requires SIMION 8.1.
         if value == None: return self._dy_mm
         assert self.check_dy_mm(value), self.error()
         self._dy_mm = value
+        self._header_cache = None
 
     def dz_mm(self, value=None):
         """
@@ -1168,6 +1505,7 @@ Gets or sets the grid unit size (mm) in the z direction.  Requires SIMION 8.1.
         if value == None: return self._dz_mm
         assert self.check_dz_mm(value), self.error()
         self._dz_mm = value
+        self._header_cache = None
 
     # Group: Boundary and Coordinates
 
@@ -1232,7 +1570,7 @@ Returns: Boolean indicating whether point is inside.
         if self._symmetry == 'planar':
             if x >= 0.0:
                 yes = (x <= self._nx-1)
-            elif self.mirror_x():
+            elif self._mirror_x:
                 yes = (-x <= self._nx-1)
             else:
                 yes = 0
@@ -1240,20 +1578,19 @@ Returns: Boolean indicating whether point is inside.
             if yes:                  
                 if y >= 0.0:
                     yes = (y <= self._ny-1)
-                elif self.mirror_y():
+                elif self._mirror_y:
                     yes = (-y <= self._ny-1)
                 else:
                     yes = 0
                 if yes and self._nz != 1: # infinite extent
                     if z >= 0.0:
                         yes = (z <= self._nz-1)
-                    elif self.mirror_z():
+                    elif self._mirror_z:
                         yes = (-z <= self._nz-1)
                     else:
                         yes = 0
         elif self._symmetry == 'cylindrical':
-            r = sqrt(y*y + z*z)
-            yes = self._inside_cylindrical_real(x, r)
+            yes = self._inside_cylindrical_real_sq(x, y*y + z*z)
         else: assert 0, "internal error: bad symmetry (" + self._symmetry + ")"
         return yes
 
@@ -1301,8 +1638,8 @@ Returns: Boolean indicating whether voxel is inside.
     # Group: Point Setters/Getters:
 
     def clear_points(self):
-        for n in range(0, self.num_points()):
-            self._points[n] = 0.0
+        self._potentials.fill(0.0)
+        self._is_electrode.fill(False)
 
     #FIX:use xi rather than x to denote integer points
     def electrode(self, x, y, z=0, is_electrode=None):
@@ -1334,16 +1671,15 @@ Returns: Boolean indicating whether point is an electrode (if getting).
 
 =cut
         """
-        assert self.inside(x,y,z), self._fail_point(x,y,z)
+        if __debug__: # inlined inside(); stripped under python -O
+            if not (0 <= x < self._nx and 0 <= y < self._ny and 0 <= z < self._nz):
+                raise IndexError(self._fail_point(x,y,z))
 
-        pos = (z * self._ny + y) * self._nx + x
+        pos = (z, y, x)
         if is_electrode == None:
-            return (self._points[pos] > self._max_voltage)
+            return self._is_electrode.item(pos)
         else:
-            if self._points[pos] > self._max_voltage:
-                if not is_electrode: self._points[pos] -= 2 * self._max_voltage
-            else:
-                if is_electrode: self._points[pos] += 2 * self._max_voltage
+            self._is_electrode[pos] = is_electrode
 
     def field(self, x, y, z=0, ex=None, ey=None, ez=None):
         """
@@ -1384,6 +1720,38 @@ lexographic order (e.g. (0,0,0), (0,0,1), ... (0,0,nx()-1), (0,1,0),
         else: # set
             self._set_field(x,y,z,ex,ey,ez)
 
+    def fill_field(self, exs, eys, ezs=0):
+        """
+=head3 fill_field
+
+  pa.fill_field(exs, eys, ezs)
+
+Sets the field (potential gradient) vectors at all points of the array
+at once.  This is equivalent to calling the setting form of field for
+every point in the required lexographic order, but the integration
+runs in a single pass (compiled, with numba).  As with field, all
+points must initially be zero volt, nonelectrodes.
+
+  (exs, eys, ezs) = other_pa.field_real_grid()
+  pa.fill_field(exs, eys, ezs)
+
+=over
+
+=item C<exs> - array of real numbers, indexed by [z, y, x], containing
+the x components of the field vectors.
+
+=item C<eys> - likewise for the y components.
+
+=item C<ezs> - likewise for the z components.
+
+=back
+
+The arrays are broadcast to the shape (nz, ny, nx) of the array.
+
+=cut
+        """
+        self._set_field_bulk(exs, eys, ezs)
+
     def field_real(self, x, y, z=0):
         """
 =head3 field_real
@@ -1415,82 +1783,89 @@ containing the x, y, and z components of the field vector respectively.
         assert self.inside_real(x,y,z), self._fail_point(x,y,z)
 
         if self._symmetry == 'cylindrical':
-            r = sqrt(y*y + z*z)
+            (Ex, Ey, Ez) = _field_cylindrical(self._potentials_flat, self._nx, self._ny,
+                                              self._min_x, x, y, z)
+        else: # planar
+            (Ex, Ey, Ez) = _field_planar(self._potentials_flat, self._nx, self._ny, self._nz,
+                                         self._min_x, self._min_y, self._min_z, x, y, z)
+        scale = self._field_scale
+        return (float(Ex * scale), float(Ey * scale), float(Ez * scale))
+
+    def field_real_batch(self, xs, ys, zs=0):
+        """
+=head3 field_real_batch
+
+  (exs, eys, ezs) = pa.field_real_batch(xs, ys, zs)
+
+Gets the electrostatic or magnetic field vectors at many real points
+at once.  This is equivalent to calling field_real for each point,
+but the whole loop runs in a single compiled (and, with numba,
+thread-parallel) kernel.
+
+  # assuming mirror_x
+  (exs, eys, ezs) = pa.field_real_batch([-10.3, 5.0], [20.2, 1.5], [30.7, 0.0])
+
+=over
+
+=item C<xs> - array of real numbers containing x positions in grid points.
+
+=item C<ys> - array of real numbers containing y positions in grid points.
+
+=item C<zs> - array of real numbers containing z positions in grid points.
+
+=back
+
+The arrays are broadcast against each other.
 
-            #FIX:Q:is there a better way to handle boundary conditions?
-            xm = x - 0.5
-            min_x = self.mirror_x() and -(self._nx-1) or 0
-            if xm < min_x: xm = min_x
-
-            xp = x + 0.5
-            if xp > self._nx-1: xp = self._nx-1
-
-            rm = r - 0.5
-            min_r = -(self._ny-1)
-            if rm < min_r: rm = min_r # won't occur?
-
-            rp = r + 0.5
-            if rp > self._ny-1: rp = self._ny-1
-
-            # FIX:Q:should the sampling be done before or after
-            # applying cylindrical symmetry?
-            V2 = self.potential_real(xp, r,  0.0)
-            V1 = self.potential_real(xm, r,  0.0)
-            V4 = self.potential_real(x,  rp, 0.0)
-            V3 = self.potential_real(x,  rm, 0.0)
-
-            # print "V1, V2, V3, V4\n"
-
-            Ex = (V1 - V2) / (xp - xm)
-            Er = (V3 - V4) / (rp - rm)
-            Ey = Er * (r == 0 and 1 or y/r)
-            Ez = Er * (r != 0 and z/r or 0.0)
-            if self._field_type == 'magnetic':
-                Ex *= self._ng
-                Ey *= self._ng
-                Ez *= self._ng
-                Er *= self._ng
-            return (Ex, Ey, Ez)
+Returns: (exs, eys, ezs) tuple of arrays of the broadcast shape,
+containing the x, y, and z components of the field vectors respectively.
+
+=cut
+        """
+        (shape, xs, ys, zs) = self._real_batch_args(xs, ys, zs)
+
+        exs = np.empty(xs.size, dtype=np.float64)
+        eys = np.empty(xs.size, dtype=np.float64)
+        ezs = np.empty(xs.size, dtype=np.float64)
+        scale = self._field_scale
+        if self._symmetry == 'cylindrical':
+            _field_real_cylindrical_batch(self._potentials_flat, self._nx, self._ny,
+                                          self._min_x, scale, xs, ys, zs, exs, eys, ezs)
         else: # planar
-            #FIX:Q:is there a better way to handle boundary conditions?
-            xm = x - 0.5
-            min_x = self.mirror_x() and -(self._nx-1) or 0
-            if xm < min_x: xm = min_x
-
-            xp = x + 0.5
-            if xp > self._nx-1: xp = self._nx-1
-
-            ym = y - 0.5
-            min_y = self.mirror_y() and -(self._ny-1) or 0
-            if ym < min_y: ym = min_y
-
-            yp = y + 0.5
-            if yp > self._ny-1: yp = self._ny-1
-
-            zm = z - 0.5
-            min_z = self.mirror_z() and -(self._nz-1) or 0
-            if zm < min_z: zm = min_z
-
-            zp = z + 0.5
-            if zp > self._nz-1: zp = self._nz-1
-            V2 = self.potential_real(xp, y,  z)
-            V1 = self.potential_real(xm, y,  z)
-            V4 = self.potential_real(x,  yp, z)
-            V3 = self.potential_real(x,  ym, z)
-            V5 = 0.0
-            V6 = 0.0
-            if self._nz != 1:
-                V6 = self.potential_real(x, y, zp)
-                V5 = self.potential_real(x, y, zm)
-            Ex = (V1 - V2) / (xp - xm)
-            Ey = (V3 - V4) / (yp - ym)
-            Ez = (self._nz != 1) and (V5 - V6) / (zp - zm) or 0.0
-
-            if self._field_type == 'magnetic':
-                Ex *= self._ng
-                Ey *= self._ng
-                Ez *= self._ng
-            return (Ex, Ey, Ez)
+            _field_real_planar_batch(self._potentials_flat, self._nx, self._ny, self._nz,
+                                     self._min_x, self._min_y, self._min_z, scale,
+                                     xs, ys, zs, exs, eys, ezs)
+        return (exs.reshape(shape), eys.reshape(shape), ezs.reshape(shape))
+
+    def field_real_grid(self):
+        """
+=head3 field_real_grid
+
+  (exs, eys, ezs) = pa.field_real_grid()
+
+Gets the electrostatic or magnetic field vectors at all grid points
+of the array, e.g. for exporting a field map.  The values are the
+same as given by field_real at the integer points, but are computed
+in a single cache-blocked (and, with numba, thread-parallel) pass.
+
+  (exs, eys, ezs) = pa.field_real_grid()
+  print exs[30, 20, 10]   # same as pa.field_real(10, 20, 30)[0]
+
+Returns: (exs, eys, ezs) tuple of arrays of shape (nz, ny, nx), indexed
+by [z, y, x], containing the x, y, and z components of the field
+vectors respectively.
+
+=cut
+        """
+        shape = (self._nz, self._ny, self._nx)
+        exs = np.empty(shape, dtype=np.float64)
+        eys = np.empty(shape, dtype=np.float64)
+        ezs = np.empty(shape, dtype=np.float64)
+        _field_real_grid(self._potentials_flat, self._nx, self._ny, self._nz,
+                         self._min_x, self._min_y, self._min_z,
+                         self._symmetry == 'cylindrical', self._field_scale,
+                         exs, eys, ezs)
+        return (exs, eys, ezs)
 
     def point(self, x, y, z=0, is_electrode = None, potential=None):
         """
@@ -1532,22 +1907,69 @@ Returns: (is_electrode, potential) tuple (if getting).
 
 =cut
         """
-        assert self.inside(x,y,z), self._fail_point(x,y,z)
+        if __debug__: # inlined inside(); stripped under python -O
+            if not (0 <= x < self._nx and 0 <= y < self._ny and 0 <= z < self._nz):
+                raise IndexError(self._fail_point(x,y,z))
 
-        pos = (z * self._ny + y) * self._nx + x
+        pos = (z, y, x)
 
         if is_electrode != None and potential == None: potential = 0.0
 
         if is_electrode == None:
-            potential = self._points[pos]
-            is_electrode = (potential > self._max_voltage)
-            if is_electrode: potential -= 2 * self._max_voltage
-            return (is_electrode, potential)
+            return (self._is_electrode.item(pos), self._potentials.item(pos))
         else:
             if potential > self._max_voltage:
                 self.max_voltage(potential * 2.0)
-            self._points[pos] = potential
-            if is_electrode: self._points[pos] += 2 * self._max_voltage
+            self._potentials[pos] = potential
+            self._is_electrode[pos] = is_electrode
+
+    def fill_points(self, xs, ys, zs=0, is_electrode=0, potential=0.0):
+        """
+=head3 fill_points
+
+  pa.fill_points(xs, ys, zs, is_electrodes, potentials)
+
+Sets the Boolean electrode state and the potential at many integer
+points at once.  This is equivalent to calling point for each point,
+except that max_voltage is raised at most once (to twice the largest
+given potential) if any potential exceeds it.
+
+  pa.fill_points([10, 11], [20, 20], [30, 30], 1, [2.15, 3.0])
+
+=over
+
+=item C<xs> - array of integers containing x positions in grid points.
+
+=item C<ys> - array of integers containing y positions in grid points.
+
+=item C<zs> - array of integers containing z positions in grid points.
+
+=item C<is_electrode> - array of Booleans indicating whether the points
+are electrodes.
+
+=item C<potential> - array of real numbers containing the potential values.
+
+=back
+
+The arrays are broadcast against each other.  If a point is given
+more than once, the last value is kept.  Positions must be integers;
+real numbers raise IndexError rather than being truncated.
+
+=cut
+        """
+        xs, ys, zs = (self._index_array(xs), self._index_array(ys),
+                      self._index_array(zs))
+        xs, ys, zs, is_electrode, potential = np.broadcast_arrays(
+            xs, ys, zs, np.asarray(is_electrode, dtype=np.bool_),
+            np.asarray(potential, dtype=np.float64))
+        inside = self._inside_batch(xs, ys, zs)
+        assert inside.all(), self._fail_batch(xs, ys, zs, inside)
+
+        max_potential = float(potential.max(initial=self._max_voltage))
+        if max_potential > self._max_voltage:
+            self.max_voltage(max_potential * 2.0)
+        self._potentials[zs, ys, xs] = potential
+        self._is_electrode[zs, ys, xs] = is_electrode
 
     def potential(self, x, y, z=0, potential=None):
         """
@@ -1577,20 +1999,18 @@ Returns: potential (if getting).
 
 =cut
         """
-        assert self.inside(x,y,z), self._fail_point(x,y,z)
+        if __debug__: # inlined inside(); stripped under python -O
+            if not (0 <= x < self._nx and 0 <= y < self._ny and 0 <= z < self._nz):
+                raise IndexError(self._fail_point(x,y,z))
 
-        pos = (z * self._ny + y) * self._nx + x
-        is_electrode = (self._points[pos] > self._max_voltage)
+        pos = (z, y, x)
 
         if potential == None:
-            val = self._points[pos]
-            if is_electrode: val -= 2 * self._max_voltage
-            return val
+            return self._potentials.item(pos)
         else:
             if potential > self._max_voltage:
                 self.max_voltage(potential * 2.0)
-            self._points[pos] = potential
-            if is_electrode: self._points[pos] += 2 * self._max_voltage
+            self._potentials[pos] = potential
 
     #FIX? rename? potential_real --> potential, and potential --> potential_int ?
     def potential_real(self, x, y, z=0):
@@ -1633,65 +2053,57 @@ Returns: real number containing interpolated potential value.
         p = 0.0
         if self._symmetry == 'planar':
             if self._nz == 1: # 2D
-                xi = int(xeff)
-                yi = int(yeff)
-
-                wx = xeff - xi
-                wy = yeff - yi
-                # note the checks on wx and wy to protect against cases where
-                # xi + 1 == nx or yi + 1 == ny.
-                p = \
-                    (1-wx) * (1-wy) *              self.potential(xi,   yi,   0) + \
-                       wx  * (1-wy) * ((wx != 0) and self.potential(xi+1, yi,   0) or 0.0) + \
-                    (1-wx) *    wy  * ((wy != 0) and self.potential(xi,   yi+1, 0) or 0.0) + \
-                       wx  *    wy  * ((wx != 0 and \
-                                        wy != 0) and self.potential(xi+1, yi+1, 0) or 0.0)
-                
+                p = _bilinear_2d(self._potentials_flat, self._nx, xeff, yeff)
             else: # 3D
-                xi = int(xeff)
-                yi = int(yeff)
-                zi = int(zeff)
-
-                wx = xeff - xi
-                wy = yeff - yi
-                wz = zeff - zi
-
-                # note the checks on wx, wy, and wz to protect against cases where
-                # xi + 1 == nx, yi + 1 == ny, or zi + 1 == nz.
-                p = \
-                    (1-wx)*(1-wy)*(1-wz)*self.potential(xi, yi, zi) + \
-                       wx *(1-wy)*(1-wz)*((wx != 0) and self.potential(xi+1, yi,   zi) or 0.0) + \
-                    (1-wx)*   wy *(1-wz)*((wy != 0) and self.potential(xi,   yi+1, zi) or 0.0) + \
-                       wx *   wy *(1-wz)*((wx != 0 and \
-                                           wy != 0) and self.potential(xi+1, yi+1, zi) or 0.0) + \
-                    (1-wx)*(1-wy)*   wz *((wz != 0) and self.potential(xi  , yi, zi+1) or 0.0) + \
-                       wx *(1-wy)*   wz *((wx != 0 and \
-                                           wz != 0) and self.potential(xi+1, yi,   zi+1) or 0.0) + \
-                    (1-wx)*   wy *   wz *((wy != 0 and \
-                                           wz != 0) and self.potential(xi,   yi+1, zi+1) or 0.0) + \
-                       wx *   wy *   wz *((wx != 0 and \
-                                           wy != 0 and \
-                                           wz != 0) and self.potential(xi+1, yi+1, zi+1) or 0.0) \
-                 
+                p = _trilinear_3d(self._potentials_flat, self._nx, self._ny,
+                                  xeff, yeff, zeff)
         elif self._symmetry == 'cylindrical':
             r = sqrt(y*y + z*z)
+            p = _bilinear_2d(self._potentials_flat, self._nx, xeff, r)
+        else: assert 0, "internal error: bad symmetry (" + self._symmetry + ")"
 
-            xi = int(xeff)
-            ri = int(r)
-            wx = xeff - xi
-            wr = r - ri
-            # note the checks on wx and wr to protect against cases where
-            # xi + 1 == nx or ri + 1 == nr.
-            p = \
-                (1-wx) * (1-wr) * self.potential(xi, ri, 0) + \
-                   wx  * (1-wr) * ((wx != 0) and self.potential(xi+1, ri,   0) or 0.0) + \
-                (1-wx) *    wr  * ((wr != 0) and self.potential(xi,   ri+1, 0) or 0.0) + \
-                   wx  *    wr  * ((wx != 0 and \
-                                    wr != 0) and self.potential(xi+1, ri+1, 0) or 0.0)
+        return float(p)
 
-        else: assert 0, "internal error: bad symmetry (" + self._symmetry + ")"
+    def potential_real_batch(self, xs, ys, zs=0):
+        """
+=head3 potential_real_batch
+
+  ps = pa.potential_real_batch(xs, ys, zs)
+
+Gets the interpolated potentials at many real points at once,
+e.g. to resample the array on a finer grid.  This is equivalent to
+calling potential_real for each point, but the whole loop runs in a
+single compiled (and, with numba, thread-parallel) kernel.
+
+  xs, ys = numpy.meshgrid(numpy.linspace(0, 10, 101), numpy.linspace(0, 5, 51))
+  ps = pa.potential_real_batch(xs, ys)
+
+=over
+
+=item C<xs> - array of real numbers containing x positions in grid points.
+
+=item C<ys> - array of real numbers containing y positions in grid points.
+
+=item C<zs> - array of real numbers containing z positions in grid points.
+
+=back
+
+The arrays are broadcast against each other.
+
+Returns: array of the broadcast shape containing interpolated potential values.
 
-        return p
+=cut
+        """
+        (shape, xs, ys, zs) = self._real_batch_args(xs, ys, zs)
+
+        ps = np.empty(xs.size, dtype=np.float64)
+        if self._symmetry == 'cylindrical':
+            _potential_real_cylindrical_batch(self._potentials_flat, self._nx,
+                                              xs, ys, zs, ps)
+        else: # planar
+            _potential_real_planar_batch(self._potentials_flat, self._nx, self._ny, self._nz,
+                                         xs, ys, zs, ps)
+        return ps.reshape(shape)
 
     def solid(self, x, y, z=0, is_electrode=None):
         """
@@ -1732,40 +2144,13 @@ Returns: is_solid (if getting)
         assert self.voxel_inside(x,y,z), \
             "voxel (" + str(x) + "," + str(y) + "," + str(z) + ") out of bounds."
 
+        # the 2x2 (2D planar or cylindrical) or 2x2x2 (3D) corner points;
+        # z:z+2 is clipped to the single layer when nz == 1.
+        corners = self._is_electrode[z:z+2, y:y+2, x:x+2]
         if is_electrode == None:
-            if self._nz == 1: # 2D planar or cylindrical
-                electrode = \
-                    self.electrode(x,   y,   z) and \
-                    self.electrode(x+1, y,   z) and \
-                    self.electrode(x,   y+1, z) and \
-                    self.electrode(x+1, y+1, z)
-                return electrode
-            else: # 3D
-                electrode = \
-                    self.electrode(x,   y,   z) and \
-                    self.electrode(x+1, y,   z) and \
-                    self.electrode(x,   y+1, z) and \
-                    self.electrode(x+1, y+1, z) and \
-                    self.electrode(x,   y,   z+1) and \
-                    self.electrode(x+1, y,   z+1) and \
-                    self.electrode(x,   y+1, z+1) and \
-                    self.electrode(x+1, y+1, z+1)
-                return electrode
+            return bool(corners.all())
         else: # set
-            if self._nz == 1: # 2D planar or cylindrical
-                self.electrode(x,   y,   z, is_electrode)
-                self.electrode(x+1, y,   z, is_electrode)
-                self.electrode(x,   y+1, z, is_electrode)
-                self.electrode(x+1, y+1, z, is_electrode)
-            else: # 3D
-                self.electrode(x,   y,   z,   is_electrode)
-                self.electrode(x+1, y,   z,   is_electrode)
-                self.electrode(x,   y+1, z,   is_electrode)
-                self.electrode(x+1, y+1, z,   is_electrode)
-                self.electrode(x,   y,   z+1, is_electrode)
-                self.electrode(x+1, y,   z+1, is_electrode)
-                self.electrode(x,   y+1, z+1, is_electrode)
-                self.electrode(x+1, y+1, z+1, is_electrode)
+            corners[...] = is_electrode
 
 
     def raw(self, x, y, z=0, val=None):
@@ -1799,14 +2184,21 @@ Returns: real number containing raw value.
 
 =cut
         """
-        assert self.inside(x,y,z), self._fail_point(x,y,z)
+        if __debug__: # inlined inside(); stripped under python -O
+            if not (0 <= x < self._nx and 0 <= y < self._ny and 0 <= z < self._nz):
+                raise IndexError(self._fail_point(x,y,z))
 
-        pos = (z * self._ny + y) * self._nx + x
+        pos = (z, y, x)
 
         if val == None:
-            return self._points[pos]
+            val = self._potentials.item(pos)
+            if self._is_electrode.item(pos): val += self._two_max_voltage
+            return val
         else:
-            self._points[pos] = val
+            is_electrode = val > self._max_voltage
+            if is_electrode: val -= self._two_max_voltage
+            self._potentials[pos] = val
+            self._is_electrode[pos] = is_electrode
 
 
     # Group: Checkers
@@ -1899,7 +2291,7 @@ err is a string containing any error message.
                 self._error = "mirror and mirror_z named parameters cannot coexist."
                 return 0
 
-            (mirror_x, mirror_y, mirror_z) = self._parse_mirror(mirror)
+            (mirror_x, mirror_y, mirror_z) = _parse_mirror(mirror)
 
         if symmetry == 'cylindrical' and mirror_y == 0:
             self._error = "y mirroring must be enabled under cylindrical symmetry."
@@ -1994,8 +2386,7 @@ err is a string containing any error message.
 
 =cut
         """
-        m = re.match('^x?y?z?$', mirror)
-        if m == None:
+        if mirror not in _VALID_MIRRORS:
             self._error = "Mirror string (" + mirror + ") invalid."
             return 0
         return 1
@@ -2331,115 +2722,119 @@ Get last error message generated by one of the check calls.
 
 
 
-    def _parse_mirror(self, mirror):
-        m = re.match('^(x?)(y?)(z?)$', mirror)
-        assert m != None, "Invalid mirroring (" + mirror + ")."
-        return (m.group(1) != '', m.group(2) != '', m.group(3) != '')
-
-    def _inside_cylindrical_real(self, x, r):
+    # r2 is the squared radius, which saves a sqrt per bounds check.
+    def _inside_cylindrical_real_sq(self, x, r2):
         yes = 1
         if x >= 0.0:
             yes = (x <= self._nx-1)
-        elif self.mirror_x():
+        elif self._mirror_x:
             yes = (-x <= self._nx-1)
         else:
             yes = 0
         if yes:
-            yes = (r <= self._ny - 1)
+            yes = (r2 <= self._ny_minus_1_sq)
         return yes
 
+    def _inside_real_batch(self, xs, ys, zs):
+        # vectorized inside_real over flat arrays
+        yes = (np.abs(xs) <= self._nx-1) & ((xs >= 0.0) | bool(self._mirror_x))
+        if self._symmetry == 'cylindrical':
+            yes &= ys*ys + zs*zs <= self._ny_minus_1_sq
+        else:
+            yes &= (np.abs(ys) <= self._ny-1) & ((ys >= 0.0) | bool(self._mirror_y))
+            if self._nz != 1: # infinite extent
+                yes &= (np.abs(zs) <= self._nz-1) & ((zs >= 0.0) | bool(self._mirror_z))
+        return yes
+
+    # Broadcasts real point coordinates to flat contiguous float64 arrays
+    # for the batch kernels and checks that all points are inside_real.
+    # Returns (shape, xs, ys, zs) with shape being the broadcast shape.
+    def _real_batch_args(self, xs, ys, zs):
+        xs, ys, zs = np.broadcast_arrays(np.asarray(xs, dtype=np.float64),
+                                         np.asarray(ys, dtype=np.float64),
+                                         np.asarray(zs, dtype=np.float64))
+        shape = xs.shape
+        xs = np.ascontiguousarray(xs).reshape(-1)
+        ys = np.ascontiguousarray(ys).reshape(-1)
+        zs = np.ascontiguousarray(zs).reshape(-1)
+        inside = self._inside_real_batch(xs, ys, zs)
+        assert inside.all(), self._fail_batch(xs, ys, zs, inside)
+        return (shape, xs, ys, zs)
+
+    # Integer grid coordinates as an intp array.  Like indexing a single
+    # point with a real number, non-integer coordinates raise IndexError
+    # instead of being truncated.
+    def _index_array(self, xs):
+        xs = np.asarray(xs)
+        if xs.size and not np.issubdtype(xs.dtype, np.integer):
+            raise IndexError("point coordinates must be integers, not " + str(xs.dtype))
+        return xs.astype(np.intp, copy=False)
+
+    def _inside_batch(self, xs, ys, zs):
+        # vectorized inside
+        return ((xs >= 0) & (xs < self._nx) &
+                (ys >= 0) & (ys < self._ny) &
+                (zs >= 0) & (zs < self._nz))
+
+    def _fail_batch(self, xs, ys, zs, inside):
+        i = np.flatnonzero(~inside)[0]
+        return self._fail_point(xs.flat[i], ys.flat[i], zs.flat[i])
+
     def _set_field(self, x, y, z, field_x, field_y, field_z=0):
-        # perform numerical integration to solve the following for V:
-        #
-        #   E = - grad(V)
-        #
-        # This is done by the line integral:
-        #
-        #   V(x,y,z) = V(0,0,0) + line_integral_{C} E * n ds
-        #
-        # where C is an arbitrary path from (0,0,0) to (x,y,z).  For
-        # each point (x,y,z), we actually do a weighted average of all
-        # lattice paths (0,0,0) to (x,y,z) of length x+y+z.  In this
-        # algorithm, the trapezoidal rule is used for the numerical
-        # integration due to a nice algorithm requiring only O(1)
-        # additional memory usage.
-        #
-        # Currently, V(0,0,0) is assumed to be zero.
-        is_electrode = 0
-
-        if self.field_type() == 'magnetic':
-            field_x /= self.ng()
-            field_y /= self.ng()
-            field_z /= self.ng()
-
-        if x != self.nx() - 1:
-            self.point(x + 1, y, z, 0,
-                       self.raw(x + 1, y, z) - field_x)
-        if y != self.ny() - 1:
-            self.point(x, y + 1, z, 0,
-                       self.raw(x, y + 1, z) - field_y)
-        if z != self.nz() - 1:
-            self.point(x, y, z + 1, 0,
-                       self.raw(x, y, z + 1) - field_z)
-
-        if x != 0 and y != 0 and z != 0:
-            val = \
-                (self.potential(x-1, y,   z) + \
-                 self.potential(x,   y-1, z) + \
-                 self.potential(x,   y,   z-1)) / 3.0 + \
-                (self.raw(x,   y,   z) - \
-                 field_x - field_y - field_z) / 6.0
-            
-            self.point(x, y, z, is_electrode, val)
-        elif x != 0 and y != 0: # z == 0
-            val = \
-                (self.potential(x-1, y,   z) + \
-                 self.potential(x,   y-1, z)) / 2.0 + \
-                (self.raw(x,   y,   z) - \
-                 field_x - field_y) / 4.0
-            
-            self.point(x, y, z, is_electrode, val)
-        elif x != 0 and z != 0: # y == 0
-            val = \
-                (self.potential(x-1, y,   z) + \
-                 self.potential(x,   y,   z-1)) / 2.0 + \
-                (self.raw(x,   y,   z) - \
-                 field_x - field_z) / 4.0
-            
-            self.point(x, y, z, is_electrode, val)
-        elif y != 0 and z != 0: # x == 0
-            val = \
-                (self.potential(x,   y-1, z) + \
-                 self.potential(x,   y,   z-1)) / 2.0 + \
-                (self.raw(x,   y,   z) - \
-                 field_y - field_z) / 4.0
-            
-            self.point(x, y, z, is_electrode, val)
-        elif z != 0: # x == 0 and y == 0
-            val = \
-                 self.potential(x,   y,   z-1) + \
-                (self.raw(x,   y,   z) - \
-                 field_z) / 2.0
-            
-            self.point(x, y, z, is_electrode, val)
-        elif y != 0: # x == 0 and z == 0
-            val = \
-                 self.potential(x,   y-1, z) + \
-                (self.raw(x,   y,   z) - \
-                 field_y) / 2.0
-            
-            self.point(x, y, z, is_electrode, val)
-        elif x != 0: # y == 0 and z == 0
-            val = \
-                 self.potential(x-1, y,   z) + \
-                (self.raw(x,   y,   z) - \
-                 field_x) / 2.0
-            
-            self.point(x, y, z, is_electrode, val)
-        else: # x == 0 and y == 0 and z == 0
-            self.point(x, y, z, is_electrode, 0)
-
-        #print "DEBUG:point=", self.potential(x, y, z), "\n"
+        # see _set_field_at for the integration scheme.
+        if not (0 <= x < self._nx and 0 <= y < self._ny and 0 <= z < self._nz):
+            raise IndexError(self._fail_point(x,y,z))
+
+        # field() passes ez=None for 2D arrays, where field_z is unused
+        if field_z is None: field_z = 0.0
+
+        # undo the field scaling of field_real (ng if magnetic, else 1)
+        scale = self._field_scale
+        max_voltage = _set_field_at(self._potentials, self._is_electrode, x, y, z,
+                                    float(field_x) / scale, float(field_y) / scale,
+                                    float(field_z) / scale, float(self._max_voltage))
+        if max_voltage != self._max_voltage: self.max_voltage(float(max_voltage))
+
+    def _set_field_bulk(self, field_xs, field_ys, field_zs=0):
+        # _set_field for all points; see _set_field_grid.
+        if field_zs is None: field_zs = 0.0
+        shape = (self._nz, self._ny, self._nx)
+        # dividing by the scale also makes fresh contiguous float64 arrays
+        scale = self._field_scale
+        field_xs = np.broadcast_to(np.asarray(field_xs, dtype=np.float64), shape) / scale
+        field_ys = np.broadcast_to(np.asarray(field_ys, dtype=np.float64), shape) / scale
+        field_zs = np.broadcast_to(np.asarray(field_zs, dtype=np.float64), shape) / scale
+        max_voltage = _set_field_grid(self._potentials, self._is_electrode,
+                                      field_xs, field_ys, field_zs, float(self._max_voltage))
+        if max_voltage != self._max_voltage: self.max_voltage(float(max_voltage))
+
+    def _update_min_bounds(self):
+        self._min_x = self._mirror_x and -(self._nx-1.0) or 0.0
+        self._min_y = self._mirror_y and -(self._ny-1.0) or 0.0
+        self._min_z = self._mirror_z and -(self._nz-1.0) or 0.0
+
+    def _update_field_scale(self):
+        self._field_scale = 1.0
+        if self._field_type == 'magnetic': self._field_scale = float(self._ng)
+
+    def _build_header_bytes(self):
+        symmetry = (self._symmetry == "planar") and 1 or 0
+
+        raw_mirror = 0
+        if self._mirror_x: raw_mirror |= 1
+        if self._mirror_y: raw_mirror |= 2
+        if self._mirror_z: raw_mirror |= 4
+        if self._field_type == "magnetic": raw_mirror |= 8
+        if self._ng >= 1 and self._ng <= 90000 and self._ng == floor(self._ng):
+            raw_mirror |= (self._ng << 4)
+        mode = self.mode()
+        header_str = _INT_STRUCT.pack(mode) + \
+            _HEADER_STRUCT.pack(symmetry, self._max_voltage, \
+            self._nx, self._ny, self._nz, raw_mirror)
+        if mode <= -2:
+            header_str += _MM_STRUCT.pack( \
+                self._dx_mm, self._dy_mm, self._dz_mm)
+        return header_str
 
     def _fail_point(self, x, y, z):
         return "point (" + str(x) + "," + str(y) + "," + str(z) + \
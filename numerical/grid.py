@@ -1,19 +1,33 @@
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional, Tuple
 import numpy as np
 
 
+@lru_cache(maxsize=256)
+def _linspace(start: float, stop: float, num: int) -> np.ndarray:
+    """np.linspace с кешем. Массив общий для всех сеток с теми же осями, поэтому только для чтения"""
+    a = np.linspace(start, stop, num)
+    a.flags.writeable = False
+    return a
+
+
 class Grid3DParams:
     """
     класс для работы с 3D сеткой
     """
-    @dataclass
+    __slots__ = ('x_max', 'y_max', 'z_max', 'gridstep_mm', 'raw_mirror', 'mirror',
+                 'len_on_x', 'len_on_y', 'len_on_z', 'xs', 'ys', 'zs')
+
+    # без slots=True: он требует Python 3.10, а экземпляры всё равно общие (см. create_from_str)
+    @dataclass(frozen=True)
     class MirrorDirection:
         x: bool = False
         y: bool = False
         z: bool = False
 
         @classmethod
+        @lru_cache(maxsize=None)  # неизменяемые, поэтому одинаковые строки разделяют один объект
         def create_from_str(cls, str_mirror: str):
             return cls(
                 x="x" in str_mirror,
@@ -75,9 +89,9 @@ class Grid3DParams:
             self.len_on_z = len_on_z
 
         # тут надо для "без отражения" изменить что-нибудь... В зависимости от того, располагаем ли центр по центру или сбоку и всё в этом духе
-        self.xs = np.linspace(0, self.x_max, self.len_on_x) if self.mirror.x else np.linspace(-self.x_max/2, self.x_max/2, self.len_on_x)
-        self.ys = np.linspace(0, self.y_max, self.len_on_y) if self.mirror.y else np.linspace(-self.y_max/2, self.y_max/2, self.len_on_y)
-        self.zs = np.linspace(0, self.z_max, self.len_on_z) if self.mirror.z else np.linspace(-self.z_max/2, self.z_max/2, self.len_on_z)
+        self.xs = _linspace(0, self.x_max, self.len_on_x) if self.mirror.x else _linspace(-self.x_max/2, self.x_max/2, self.len_on_x)
+        self.ys = _linspace(0, self.y_max, self.len_on_y) if self.mirror.y else _linspace(-self.y_max/2, self.y_max/2, self.len_on_y)
+        self.zs = _linspace(0, self.z_max, self.len_on_z) if self.mirror.z else _linspace(-self.z_max/2, self.z_max/2, self.len_on_z)
 
     def __str__(self):
         return f"grid 3d with len on (x,y,z): ({self.len_on_x}, {self.len_on_y}, {self.len_on_y}), mirror: {self.mirror}"
@@ -91,3 +105,9 @@ class Grid3DParams:
         Однако, хоть вообще говорят индексы должны быть целочисленные, иногда (например для усреднения) лучше иметь их без округления
         """
         return x / self.gridstep_mm, y / self.gridstep_mm, z / self.gridstep_mm
+
+    def get_indices_array(self, xs, ys, zs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        то же, что get_index_float, но сразу для массивов координат
+        """
+        return np.divide(xs, self.gridstep_mm), np.divide(ys, self.gridstep_mm), np.divide(zs, self.gridstep_mm)
@@ -1,8 +1,9 @@
+import logging
+
 from ....numerical.grid import Grid3DParams
 from ....numerical.pa.pa_service import generate_empty_pa, add_raw_extension
 from ....physical.traps.base.abstract_trap import AbstractCylCoordinateCell
 import numpy as np
-from tqdm import tqdm
 
 
 class NumericalTrapWithCylindicalCoords:
@@ -16,22 +17,24 @@ class NumericalTrapWithCylindicalCoords:
 
         # поскольку сетка имеет декартову систему координат, в то время как ловушка работает в цилиндрической, нужно всё время осуществлять переход
         # Однако делать это "на месте" долго, поэтому мы кешируем.
-        X, Y = np.meshgrid(self.grid.xs, self.grid.ys)
-        self._thetas = np.arctan2(Y.T, X.T)
-        self._rs = np.sqrt(X.T ** 2 + Y.T ** 2)
+        # массивы (nx, ny) строятся бродкастингом столбца xs против строки ys
+        X, Y = self.grid.xs[:, np.newaxis], self.grid.ys[np.newaxis, :]
+        self._thetas = np.arctan2(Y, X)
+        self._rs = np.hypot(X, Y)
 
     def generate_pa_raw_file(self, for_fast_adjust=True, *, verbose=False):
         """generate file .pa# """
         assert for_fast_adjust
         pa = generate_empty_pa(self.grid)
         filename = add_raw_extension(self.filename_base)
-        for k, z in tqdm(enumerate(self.grid.zs), total=self.grid.len_on_z, disable=not verbose):
-            for j, y in enumerate(self.grid.ys):
-                for i, x in enumerate(self.grid.xs):
-                    r, theta = self._rs[i, j], self._thetas[i, j]
-                    # r = np.sqrt(y**2+x**2)
-                    # theta = np.arctan2(y, x)
-                    if self.trap.is_point_is_in_an_electrode(r, theta, z):
-                        el_type = self.trap.get_electrode_type_when_electrode(r, theta, z)
-                        pa.point(i, j, k, 1, self.trap.electrodeConfiguration.getIndexOfElectrodeType(el_type) + 1)
+        # маска и номера электродов считаются сразу для всей сетки (x, y, z) -- бродкастингом (nx, ny, 1) против (1, 1, nz)
+        rs, thetas = self._rs[:, :, np.newaxis], self._thetas[:, :, np.newaxis]
+        zs = self.grid.zs[np.newaxis, np.newaxis, :]
+        is_electrode = self.trap.is_point_is_in_an_electrode_array(rs, thetas, zs)
+        electrode_ids = self.trap.get_electrode_id_array(rs, thetas, zs, is_electrode)
+        ii, jj, kk = np.nonzero(is_electrode)
+        pa.fill_points(ii, jj, kk, 1, electrode_ids[ii, jj, kk])
         pa.save(filename)
+        if verbose:
+            # поточечного цикла (и прогресс-бара) больше нет -- печатаем итог
+            logging.info(f"{filename}: {ii.size} electrode points on {self.grid}")
@@ -9,6 +9,7 @@ class ElectrodeType:
     тип электрода. Электроды одного типа имеют одно напряжение всегда. Приватный конструктор, не используйте его!
     """
     voltage: Optional[Volts] = None  # на электрод может быть подано напряжение
+    _index: Optional[int] = None  # индекс в ElectrodeConfiguration.electrodes, задаётся при добавлении
 
 
 class ElectrodeConfiguration:
@@ -21,14 +22,15 @@ class ElectrodeConfiguration:
         """
         добавляет новый электрод
         """
-        self.electrodes.append(ElectrodeType())
-        return self.electrodes[-1]
+        electrode = ElectrodeType()
+        electrode._index = len(self.electrodes)
+        self.electrodes.append(electrode)
+        return electrode
 
     def getIndexOfElectrodeType(self, electrode_type: ElectrodeType) -> int:
         """
         находит индекс заданного электрода
         """
-        for i, electrode in enumerate(self.electrodes):
-            if electrode_type is electrode:
-                return i
-        assert False
+        i = electrode_type._index
+        assert i is not None and i < len(self.electrodes) and self.electrodes[i] is electrode_type
+        return i
@@ -1,6 +1,8 @@
 from abc import ABCMeta, abstractmethod
 from typing import Tuple
 
+import numpy as np
+
 from .abstract_trap import AbstractCylCoordinateCell
 from .utils import PhysicalBorder, Dimention
 
@@ -29,6 +31,13 @@ class CylinderTrap(AbstractCylCoordinateCell, metaclass=ABCMeta):
                 return True
         return False
 
+    def is_point_is_in_an_electrode_array(self, rs, thetas, zs):
+        rs, thetas, zs = np.broadcast_arrays(rs, thetas, zs)
+        shell = (np.abs(zs) < self._z_full) & (self.R <= rs)
+        if self.thickness:
+            shell &= rs < self.R * (1+self.thickness)
+        return self.is_endcap_electrode_array(rs, thetas, zs) | shell
+
     def is_endcap_electrode(self, r, theta, z):
         if not self.closed:
             return False
@@ -36,3 +45,14 @@ class CylinderTrap(AbstractCylCoordinateCell, metaclass=ABCMeta):
         if self._z_full <= z and (not self.thickness or z < self._z_full * (1+self.thickness)):
             return True
         return False
+
+    def is_endcap_electrode_array(self, rs, thetas, zs):
+        """is_endcap_electrode поэлементно для массивов координат (с бродкастингом)"""
+        rs, thetas, zs = np.broadcast_arrays(rs, thetas, zs)
+        if not self.closed:
+            return np.zeros(zs.shape, dtype=bool)
+        zs = np.abs(zs)
+        endcap = self._z_full <= zs
+        if self.thickness:
+            endcap &= zs < self._z_full * (1+self.thickness)
+        return endcap
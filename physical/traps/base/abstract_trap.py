@@ -1,6 +1,8 @@
 from abc import ABCMeta, abstractmethod, abstractproperty
 from typing import Tuple, Optional
 
+import numpy as np
+
 from ....physical.electodes.base.electrode_conf import ElectrodeType, ElectrodeConfiguration
 from ....physical.traps.base.utils import PhysicalBorder
 
@@ -12,10 +14,37 @@ class AbstractCylCoordinateCell(metaclass=ABCMeta):
         """находится ли точка в каком-то электроде"""
         pass
 
+    def is_point_is_in_an_electrode_array(self, rs, thetas, zs) -> np.ndarray:
+        """
+        is_point_is_in_an_electrode поэлементно для массивов координат (с бродкастингом).
+        По умолчанию вызывается для каждой точки -- наследникам стоит переопределить векторно
+        """
+        rs, thetas, zs = np.broadcast_arrays(rs, thetas, zs)
+        mask = np.empty(rs.shape, dtype=bool)
+        for idx in np.ndindex(rs.shape):
+            mask[idx] = self.is_point_is_in_an_electrode(rs[idx], thetas[idx], zs[idx])
+        return mask
+
     @abstractmethod
     def get_electrode_type_when_electrode(self, r, theta, z) -> ElectrodeType:
         pass
 
+    def get_electrode_id_array(self, rs, thetas, zs, mask) -> np.ndarray:
+        """
+        номера электродов (с 1, как в .pa#) для массивов координат (с бродкастингом), 0 там, где mask ложна.
+        По умолчанию get_electrode_type_when_electrode вызывается для каждой точки маски -- наследникам стоит переопределить векторно
+        """
+        rs, thetas, zs, mask = np.broadcast_arrays(rs, thetas, zs, mask)
+        ids = np.zeros(mask.shape, dtype=np.int32)
+        # номера электродов считаем один раз, а не для каждой точки
+        electrode_numbers = {id(electrode): self.electrodeConfiguration.getIndexOfElectrodeType(electrode) + 1
+                             for electrode in self.electrodeConfiguration.electrodes}
+        get_electrode_type = self.get_electrode_type_when_electrode
+        points = np.nonzero(mask)
+        ids[points] = [electrode_numbers[id(get_electrode_type(r, theta, z))]
+                       for r, theta, z in zip(rs[points].tolist(), thetas[points].tolist(), zs[points].tolist())]
+        return ids
+
     def get_electrode_type_from_point(self, r, theta, z) -> Optional[ElectrodeType]:
         """потенциал ловушки в точке (для тех ловушек, где это имеет смысл)"""
         if self.is_point_is_in_an_electrode(r, theta, z):